@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import List, Dict, Tuple
 from mahjong.hand_calculating.hand import HandCalculator
 from mahjong.meld import Meld
@@ -20,8 +21,9 @@ def print_hand_result(hand_result):
 calculator = HandCalculator()
 
 class AgariJudger():    
+    __slots__ = ("options",)
+
     def __init__(self, has_daisharin=False, renhou_as_yakuman=False, ) -> None:
-        self.calculator = HandCalculator()
         self.options = OptionalRules(has_open_tanyao=False,
                                      has_aka_dora=False,
                                      has_double_yakuman=True,
@@ -70,4 +72,11 @@ class AgariJudger():
                                                                                 tsumi_number=tsumi_number)
                                                             )
         return result
-        
\ No newline at end of file
+
+
+@lru_cache(maxsize=None)
+def shared_judger(has_daisharin=False, renhou_as_yakuman=False) -> AgariJudger:
+    """
+    AgariJudger holds no per-game state, so rooms with the same yaku rules share one instance.
+    """
+    return AgariJudger(has_daisharin=has_daisharin, renhou_as_yakuman=renhou_as_yakuman)
@@ -0,0 +1,75 @@
+# pylint: disable=missing-function-docstring, missing-module-docstring, missing-class-docstring, line-too-long
+"""
+Micro-benchmark of the game core: memory per started room and time per ChinitsuGame.input call.
+
+    python bench_core.py [--rooms 2000] [--actions 200000]
+"""
+import argparse, gc, logging, random, time, tracemalloc
+from game import ChinitsuGame
+from fuzz import PLAYERS, guided_step, new_game
+
+logging.getLogger("uvicorn").setLevel(logging.ERROR)
+
+
+def new_room(seed: int = None) -> ChinitsuGame:
+    """
+    Started two-player room. Without a seed it is built like the server does (no per-room RNG).
+    """
+    if seed is None:
+        game = ChinitsuGame()
+        for p_id in PLAYERS:
+            game.add_player(p_id)
+        game.set_running()
+    else:
+        game = new_game(seed)
+    game.input("start_new", None, PLAYERS[0])
+    return game
+
+
+def bytes_per_room(rooms: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    games = [new_room() for _ in range(rooms)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del games
+    return (after - before) / rooms
+
+
+def us_per_action(actions: int, seed: int = 0) -> float:
+    rng = random.Random(seed)
+    # pre-generate a legal action stream (ints mark a fresh room) so only ChinitsuGame.input is timed
+    steps, game = [seed], new_room(seed)
+    while len(steps) < actions:
+        if len(game.yama) < 2:
+            room_seed = rng.randrange(1 << 30)
+            game = new_room(room_seed)
+            steps.append(room_seed)
+        step = guided_step(game, rng, allow_agari=False)
+        game.input(*step)
+        steps.append(step)
+
+    elapsed, timed = 0.0, 0
+    for step in steps:
+        if isinstance(step, int):
+            game = new_room(step)
+            continue
+        start = time.perf_counter()
+        game.input(*step)
+        elapsed += time.perf_counter() - start
+        timed += 1
+    return elapsed / timed * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=2000)
+    parser.add_argument("--actions", type=int, default=200_000)
+    args = parser.parse_args()
+    print(f"bytes/room:  {bytes_per_room(args.rooms):,.0f}")
+    print(f"us/action:   {us_per_action(args.actions):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# pylint: disable=missing-function-docstring, missing-module-docstring, missing-class-docstring, line-too-long
+"""
+Compare the start_server.py choices that matter for our WebSocket workload.
+
+Game traffic: for every event loop x WebSocket implementation (--loop, --ws) a server is launched, then
+--pairs concurrent rooms play draw/discard/skip_ron games (restarting when the yama runs out) for --seconds.
+Reports actions/s and per-action round-trip latency. Sockets stay open for the whole run, so the HTTP
+parser is not involved here.
+
+Connection setup: the HTTP parser (--http) only handles the upgrade handshake, so it is measured separately
+by --pairs clients repeatedly opening a room, waiting for its greeting and closing it. Reports connections/s
+and connect-to-greeting latency.
+
+    python bench_server.py --pairs 50 --seconds 10
+"""
+import argparse, asyncio, itertools, json, signal, socket, subprocess, sys, time
+from typing import List
+from start_server import HTTP_PARSERS, LOOPS, SERVER_DIR, WS_PROTOCOLS, available
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_for_port(port: int, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise TimeoutError(f"server on port {port} did not come up")
+
+
+class BenchPlayer:
+    def __init__(self, websocket) -> None:
+        self.websocket = websocket
+        self.replies: asyncio.Queue = asyncio.Queue()
+        self.reader = asyncio.ensure_future(self._read())
+
+    async def _read(self):
+        try:
+            async for message in self.websocket:
+                data = json.loads(message)
+                if data.get("heartbeat") == "ping":
+                    await self.websocket.send(json.dumps({"heartbeat": "pong", "seq": data["seq"]}))
+                elif not data.get("broadcast"):
+                    await self.replies.put(data)
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+
+async def play_room(url: str, room_name: str, deadline: float, latencies: List[float]):
+    import websockets  # pylint: disable=import-outside-toplevel
+    players = [BenchPlayer(await websockets.connect(f"{url}/ws/{room_name}/p{i}")) for i in range(2)]
+
+    async def act(seat: int, action: str, card_idx="") -> dict:
+        start = time.perf_counter()
+        await players[seat].websocket.send(json.dumps({"action": action, "card_idx": str(card_idx)}))
+        reply = await players[seat].replies.get()
+        latencies.append(time.perf_counter() - start)
+        if "player_id" in reply:  # accepted: the opponent gets the public view too
+            await players[1 - seat].replies.get()
+        return reply
+
+    try:
+        while time.monotonic() < deadline:
+            reply = await act(0, "start_new")
+            cur = 0 if reply["is_oya"] else 1
+            while time.monotonic() < deadline:
+                await act(cur, "discard", 0)
+                await act(1 - cur, "skip_ron")
+                cur = 1 - cur
+                if "player_id" not in await act(cur, "draw"):
+                    break  # yama exhausted
+    finally:
+        for p in players:
+            await p.websocket.close()
+            await p.reader
+
+
+async def run_workload(port: int, pairs: int, seconds: float):
+    latencies: List[float] = []
+    deadline = time.monotonic() + seconds
+    start = time.perf_counter()
+    await asyncio.gather(*(play_room(f"ws://127.0.0.1:{port}", f"bench-{i}", deadline, latencies) for i in range(pairs)))
+    return len(latencies) / (time.perf_counter() - start), sorted(latencies)
+
+
+async def connect_rooms(url: str, client: int, deadline: float, latencies: List[float]):
+    import websockets  # pylint: disable=import-outside-toplevel
+    for i in itertools.count():
+        if time.monotonic() >= deadline:
+            return
+        start = time.perf_counter()
+        async with websockets.connect(f"{url}/ws/conn-{client}-{i}/p0") as websocket:
+            await websocket.recv()  # "Game started in room ..."
+            latencies.append(time.perf_counter() - start)
+
+
+async def run_connections(port: int, clients: int, seconds: float):
+    latencies: List[float] = []
+    deadline = time.monotonic() + seconds
+    start = time.perf_counter()
+    await asyncio.gather(*(connect_rooms(f"ws://127.0.0.1:{port}", i, deadline, latencies) for i in range(clients)))
+    return len(latencies) / (time.perf_counter() - start), sorted(latencies)
+
+
+def percentile(values: List[float], q: float) -> float:
+    return values[min(int(q * len(values)), len(values) - 1)] if values else float("nan")
+
+
+async def bench(workload, options: List[str], args):
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, "start_server.py", "--port", str(port), *options,
+                             "--log-level", "warning", "--drain-timeout", "5"],
+                            cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await wait_for_port(port)
+        return await workload(port, args.pairs, args.seconds)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait()
+
+
+def report(labels: List[str], throughput: float, latencies: List[float]):
+    print(f"{labels[0]:8} {labels[1]:18} {throughput:10,.0f} {percentile(latencies, 0.5) * 1e3:8.2f} {percentile(latencies, 0.99) * 1e3:8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{'loop':8} {'ws':18} {'actions/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for loop, ws in itertools.product(LOOPS, WS_PROTOCOLS):
+        if not (available(LOOPS[loop]) and available(WS_PROTOCOLS[ws])):
+            print(f"{loop:8} {ws:18} {'not installed':>10}")
+            continue
+        report([loop, ws], *asyncio.run(bench(run_workload, ["--loop", loop, "--ws", ws], args)))
+
+    print(f"\n{'loop':8} {'http':18} {'conns/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for http in HTTP_PARSERS:
+        if not available(HTTP_PARSERS[http]):
+            print(f"{'auto':8} {http:18} {'not installed':>10}")
+            continue
+        report(["auto", http], *asyncio.run(bench(run_connections, ["--http", http], args)))
+
+
+if __name__ == "__main__":
+    main()
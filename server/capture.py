@@ -0,0 +1,65 @@
+# pylint: disable=missing-function-docstring, missing-module-docstring, missing-class-docstring, line-too-long
+import itertools, json, logging, time
+from typing import Dict, List
+from fastapi import WebSocket
+logger = logging.getLogger("uvicorn")
+
+
+class TrafficRecorder:
+    """
+    Records /ws sessions as JSON lines, one event per line:
+
+        {"t": 0.12, "event": "room",  "room": "r1", "seed": 42, "rules": {}}  # shuffle seed and rule overrides of a new ChinitsuGame
+        {"t": 0.13, "event": "open",  "session": 1, "room": "r1", "player": "a"}
+        {"t": 0.50, "event": "in",    "session": 1, "data": {...}}  # frame from the client
+        {"t": 0.51, "event": "out",   "session": 1, "data": {...}}  # frame to the client
+        {"t": 9.00, "event": "close", "session": 1}
+
+    `t` is seconds since the recorder started. Heartbeat frames are not recorded.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+        self.start = time.monotonic()
+        self.session_ids = itertools.count(1)
+        self.sessions: Dict[WebSocket, int] = {}
+        logger.warning(f"Capturing traffic to {path}")
+
+    def _write(self, event: dict):
+        event["t"] = round(time.monotonic() - self.start, 6)
+        self.file.write(json.dumps(event) + "\n")
+
+    def room(self, room_name: str, seed: int, rules: dict = None):
+        self._write({"event": "room", "room": room_name, "seed": seed, "rules": rules or {}})
+
+    def open(self, websocket: WebSocket, room_name: str, player_id: str):
+        session = next(self.session_ids)
+        self.sessions[websocket] = session
+        self._write({"event": "open", "session": session, "room": room_name, "player": player_id})
+
+    def inbound(self, websocket: WebSocket, data):
+        if websocket in self.sessions:
+            self._write({"event": "in", "session": self.sessions[websocket], "data": data})
+
+    def outbound(self, websocket: WebSocket, data):
+        if websocket in self.sessions:
+            self._write({"event": "out", "session": self.sessions[websocket], "data": data})
+
+    def close(self, websocket: WebSocket):
+        session = self.sessions.pop(websocket, None)
+        if session is not None:
+            self._write({"event": "close", "session": session})
+            self.file.flush()
+
+    def shutdown(self):
+        if not self.file.closed:
+            self.file.flush()
+            self.file.close()
+            logger.warning(f"Capture written: {self.path}")
+
+
+def load_capture(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    events.sort(key=lambda e: e["t"])  # stable, keeps file order for equal timestamps
+    return events
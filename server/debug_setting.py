@@ -16,7 +16,7 @@ debug_cards = {
 def insert_into_yama(yama: list, hand: list, cnt: int):
     for _ in range(cnt):
         yama.insert(0, hand.pop()) # slow but so what
-def debug_yama(debug_code: int):
+def debug_yama(debug_code: int, rng=random):
     """
     Use debug code to create cheat yama that gives designed hands for players.
     """
@@ -30,7 +30,7 @@ def debug_yama(debug_code: int):
         insert_into_yama(yama, oya_hand, 4)
 
     for _ in range(4*9-14-13):
-        x = random.randint(1,9)
+        x = rng.randint(1,9)
         yama.append(f"{x}s")
 
     return yama
@@ -0,0 +1,254 @@
+# pylint: disable=missing-function-docstring, missing-module-docstring, missing-class-docstring, line-too-long
+"""
+Stateful fuzzer for ChinitsuGame.input.
+
+Drives the engine directly (no sockets) with random and grammar-guided action sequences,
+checks invariants after every action and shrinks failing sequences.
+
+    python fuzz.py --seconds 60 --workers 8
+    python fuzz.py --replay 12345     # re-run (and shrink) a single case seed
+"""
+import argparse, logging, multiprocessing, os, random, sys, time, traceback
+from collections import Counter
+from typing import List, Tuple
+from game import ChinitsuGame, TurnState, default_rules
+from debug_setting import debug_cards
+
+logging.getLogger("uvicorn").setLevel(logging.ERROR)
+
+PLAYERS = ("p0", "p1")
+ALL_ACTIONS = ["start_new", "start", "draw", "discard", "riichi", "kan", "tsumo", "ron", "skip_ron", "bogus"]
+AGARI_ACTIONS = {"tsumo", "ron"}
+NUM_TILES = 36
+
+Step = Tuple[str, int, str]  # (action, card_idx, player_id)
+
+
+class InvariantError(AssertionError):
+    pass
+
+
+def new_game(game_seed: int) -> ChinitsuGame:
+    game = ChinitsuGame(default_rules, rng=random.Random(game_seed))
+    for p_id in PLAYERS:
+        game.add_player(p_id)
+    game.set_running()
+    return game
+
+
+def check_invariants(game: ChinitsuGame, debug: bool):
+    if game.state is None:
+        return
+    players = [game.player(p_id) for p_id in PLAYERS]
+
+    # tile conservation: every tile is in the yama, a hand, a kan or a kawa
+    tiles = Counter(game.yama)
+    for p in players:
+        tiles.update(p.hand)
+        tiles.update(card for kan in p.fuuro for card in kan)
+        tiles.update(card for card, _ in p.kawa)
+    if sum(tiles.values()) != NUM_TILES:
+        raise InvariantError(f"tile_count {sum(tiles.values())} != {NUM_TILES}")
+    if not debug and any(cnt != 4 for cnt in tiles.values()):  # debug yama fills up with random tiles
+        raise InvariantError(f"tile_kinds {dict(tiles)}")
+
+    # hand size: 13 (+1 while holding the drawn tile), each kan takes 3 tiles net
+    for p_id, p in zip(PLAYERS, players):
+        holding = game.state.current_player == p_id and game.state.is_after_draw
+        expected = (14 if holding else 13) - 3 * p.num_kan
+        if p.len_hand != expected:
+            raise InvariantError(f"hand_size {p_id} {p.len_hand} != {expected} at {game.state}")
+    if sum(p.is_oya for p in players) != 1:
+        raise InvariantError("oya_count")
+
+    # points only move into kyoutaku
+    total = sum(p.point for p in players) + 1000 * game.kyoutaku_number
+    if total != len(players) * game.rules["initial_point"]:
+        raise InvariantError(f"point_total {total}")
+
+
+def guided_step(game: ChinitsuGame, rng: random.Random, allow_agari: bool) -> Step:
+    """
+    Mostly-legal action for the current TurnState, so sequences get deep into a game.
+    """
+    state = game.state
+    if state is None or rng.random() < 0.01:
+        return (rng.choice(["start_new", "start"]), None, rng.choice(PLAYERS))
+    cur = state.current_player
+    opp = PLAYERS[1 - PLAYERS.index(cur)]
+    if state.stage == TurnState.BEFORE_DRAW:
+        return ("draw", None, cur)
+    if state.stage == TurnState.AFTER_DRAW:
+        max_idx = game.player(cur).len_hand
+        roll = rng.random()
+        if allow_agari and roll < 0.03:
+            return ("tsumo", None, cur)
+        if roll < 0.10:
+            return ("kan", rng.randrange(max_idx), cur)
+        if roll < 0.15:
+            return ("riichi", rng.randrange(max_idx), cur)
+        return ("discard", rng.randrange(max_idx), cur)
+    if allow_agari and rng.random() < 0.03:
+        return ("ron", None, opp)
+    return ("skip_ron", None, opp)
+
+
+def random_step(rng: random.Random, allow_agari: bool) -> Step:
+    actions = ALL_ACTIONS if allow_agari else [a for a in ALL_ACTIONS if a not in AGARI_ACTIONS]
+    roll = rng.random()
+    if roll < 0.1:
+        card_idx = None
+    elif roll < 0.15:
+        card_idx = rng.choice(list(debug_cards) + [101, 999999])
+    else:
+        card_idx = rng.randint(-2, 16)
+    return (rng.choice(actions), card_idx, rng.choice(PLAYERS))
+
+
+class FuzzCase:
+    """
+    One game under test, tracking what the invariants need to know about it.
+    """
+    def __init__(self, game_seed: int) -> None:
+        self.game = new_game(game_seed)
+        self.debug = False
+
+    def step(self, action: str, card_idx: int, p_id: str):
+        if action in ("start_new", "start"):
+            self.debug = card_idx in debug_cards
+        self.game.input(action, card_idx, p_id)
+        check_invariants(self.game, self.debug)
+
+
+def run_steps(game_seed: int, steps: List[Step]):
+    """
+    Replay steps on a fresh game, raising on the first crash or broken invariant.
+    """
+    case = FuzzCase(game_seed)
+    for step in steps:
+        case.step(*step)
+
+
+def signature(e: Exception) -> str:
+    if isinstance(e, InvariantError):
+        return f"{type(e).__name__}: {str(e).split(' ', 1)[0]}"
+    frame = traceback.extract_tb(e.__traceback__)[-1]
+    return f"{type(e).__name__} at {os.path.basename(frame.filename)}:{frame.lineno}"
+
+
+def generate_case(case_seed: int, max_steps: int, allow_agari: bool):
+    """
+    Run one case, building the sequence on the fly. Returns (steps, exception or None).
+    """
+    rng = random.Random(case_seed)
+    case = FuzzCase(case_seed)
+    guided = rng.random() < 0.8
+    steps: List[Step] = []
+    for _ in range(rng.randint(1, max_steps)):
+        if guided and rng.random() > 0.05:
+            step = guided_step(case.game, rng, allow_agari)
+        else:
+            step = random_step(rng, allow_agari)
+        steps.append(step)
+        try:
+            case.step(*step)
+        except Exception as e:  # pylint: disable=broad-except
+            return steps, e
+    return steps, None
+
+
+def fails_with(case_seed: int, steps: List[Step], sig: str) -> bool:
+    try:
+        run_steps(case_seed, steps)
+    except Exception as e:  # pylint: disable=broad-except
+        return signature(e) == sig
+    return False
+
+
+def shrink(case_seed: int, steps: List[Step], sig: str) -> List[Step]:
+    """
+    Delta debugging: drop chunks of halving size while the same failure reproduces.
+    """
+    chunk = max(len(steps) // 2, 1)
+    while chunk >= 1:
+        i, shrunk = 0, False
+        while i < len(steps):
+            candidate = steps[:i] + steps[i + chunk:]
+            if candidate and fails_with(case_seed, candidate, sig):
+                steps, shrunk = candidate, True
+            else:
+                i += chunk
+        if not shrunk:
+            chunk //= 2
+    return steps
+
+
+def worker(args) -> dict:
+    first_seed, stride, deadline, max_steps, allow_agari = args
+    stats = {"cases": 0, "actions": 0, "failures": {}}
+    case_seed = first_seed
+    while time.monotonic() < deadline:
+        steps, err = generate_case(case_seed, max_steps, allow_agari)
+        stats["cases"] += 1
+        stats["actions"] += len(steps)
+        if err is not None:
+            sig = signature(err)
+            if sig not in stats["failures"]:
+                stats["failures"][sig] = (case_seed, shrink(case_seed, steps, sig), "".join(traceback.format_exception(err)))
+        case_seed += stride
+    return stats
+
+
+def report_failure(sig: str, case_seed: int, steps: List[Step], tb: str):
+    print(f"\n=== {sig} (case seed {case_seed}, {len(steps)} steps after shrinking)")
+    for action, card_idx, p_id in steps:
+        print(f"  {p_id}: {action} {card_idx}")
+    print(tb)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max-steps", type=int, default=300)
+    parser.add_argument("--no-agari", action="store_true", help="skip tsumo/ron (AgariJudger dominates the cost)")
+    parser.add_argument("--replay", type=int, default=None, help="re-run a single case seed")
+    args = parser.parse_args()
+    allow_agari = not args.no_agari
+
+    if args.replay is not None:
+        steps, err = generate_case(args.replay, args.max_steps, allow_agari)
+        if err is None:
+            print(f"case {args.replay}: {len(steps)} steps, no failure")
+            return 0
+        sig = signature(err)
+        report_failure(sig, args.replay, shrink(args.replay, steps, sig), "".join(traceback.format_exception(err)))
+        return 1
+
+    seed = args.seed if args.seed is not None else random.randrange(1 << 30)
+    deadline = time.monotonic() + args.seconds
+    jobs = [(seed + i, args.workers, deadline, args.max_steps, allow_agari) for i in range(args.workers)]
+    start = time.perf_counter()
+    if args.workers > 1:
+        with multiprocessing.Pool(args.workers) as pool:
+            results = pool.map(worker, jobs)
+    else:
+        results = [worker(jobs[0])]
+    elapsed = time.perf_counter() - start
+
+    failures = {}
+    for stats in results:
+        for sig, failure in stats["failures"].items():
+            failures.setdefault(sig, failure)
+    cases = sum(s["cases"] for s in results)
+    actions = sum(s["actions"] for s in results)
+    print(f"seed {seed}: {cases} cases, {actions} actions in {elapsed:.1f}s "
+          f"({actions / elapsed * 60:,.0f} actions/min, {args.workers} workers)")
+    for sig, (case_seed, steps, tb) in failures.items():
+        report_failure(sig, case_seed, steps, tb)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,13 @@
 # pylint: disable=missing-function-docstring, missing-module-docstring, missing-class-docstring, line-too-long
 from typing import List, Dict, Tuple
 import random, time, logging
-from agari_judge import AgariJudger, HandResponse
-from debug_setting import debug_yama
+from agari_judge import AgariJudger, HandResponse, shared_judger
+from debug_setting import debug_yama, debug_cards
+from profiling import tracer, NOOP
 logger = logging.getLogger("uvicorn")
 
 WAITING, RUNNING, RECONNECT, ENDED = 0, 1, 2, 3
+ALL_TILES = tuple(f"{i}s" for i in range(1, 9+1)) * 4  # shared tile strings, so rooms don't allocate their own
 default_rules = {
     "initial_point" : 150_000,
     "no_agari_punishment": 20_000,
@@ -18,6 +20,9 @@ default_rules = {
 
 
 class ChinitsuPlayer:
+    __slots__ = ("name", "active", "point", "is_oya", "is_riichi", "is_daburu_riichi", "riichi_turn",
+                 "is_ippatsu", "is_rinshan", "is_furiten", "hand", "fuuro", "kawa", "num_kan")
+
     def __init__(self, name, initial_point: int, active=True) -> None:
         self.name = name
         self.active = active
@@ -48,8 +53,9 @@ class ChinitsuPlayer:
 
         # last card of hand is tsumo card (only after drawing a card)
         self.hand: List[str] = []
-        self.fuuro: List[Tuple[str]] = []
-        self.kawa: List[Tuple[str, bool]]= []
+        # cleared in place: ChinitsuGame keeps references to them in its public view
+        self.fuuro.clear()
+        self.kawa.clear()
         self.num_kan = 0
 
     @property
@@ -83,6 +89,7 @@ class ChinitsuPlayer:
             return False
         self.hand = [card for card in self.hand if card != kan_card]
         self.fuuro.append((kan_card, kan_card, kan_card, kan_card))
+        self.num_kan += 1
         return True
 
     def get_info(self):
@@ -96,16 +103,25 @@ class TurnState:
     BEFORE_DRAW = 1
     AFTER_DRAW = 2
     AFTER_DISCARD = 3
+    __slots__ = ("player_ids", "current_seat", "turn", "stage")
+
     def __init__(self, player_ids: List[str]) -> None:
         assert len(player_ids) == 2
         self.player_ids = player_ids
-        self.current_player: str = None
+        self.current_seat: int = None  # index into player_ids
         self.turn = 1
-        self.stage: str = self.BEFORE_DRAW
+        self.stage: int = self.BEFORE_DRAW
 
     def __str__(self):
         return f"{self.turn}: {self.current_player} - {self.stage}"
 
+    @property
+    def current_player(self) -> str:
+        return self.player_ids[self.current_seat]
+    @current_player.setter
+    def current_player(self, player_name: str):
+        self.current_seat = self.player_ids.index(player_name)
+
     def next(self):
         if self.stage == self.BEFORE_DRAW:
             self.stage = self.AFTER_DRAW
@@ -113,7 +129,7 @@ class TurnState:
             self.stage = self.AFTER_DISCARD
         elif self.stage == self.AFTER_DISCARD:
             self.stage = self.BEFORE_DRAW
-            self.current_player = self.player_ids[1 - self.player_ids.index(self.current_player)]
+            self.current_seat = 1 - self.current_seat
             self.turn += 1
 
     @property
@@ -128,26 +144,42 @@ class TurnState:
 
 
 class ChinitsuGame:
-    def __init__(self, rules: Dict=None) -> None:
-        self._players: Dict[str, ChinitsuPlayer] = {}
+    __slots__ = ("_seats", "_seat_of", "_player_ids", "_public_fuuro", "_public_kawa", "rng", "status", "state",
+                 "yama", "kyoutaku_number", "tsumi_number", "rules", "agari_judger")
+
+    def __init__(self, rules: Dict=None, rng: random.Random=None) -> None:
+        # players are addressed by seat (0/1); names only map onto seats
+        self._seats: List[ChinitsuPlayer] = []
+        self._seat_of: Dict[str, int] = {}
+        self._player_ids: List[str] = []
+        # public view shared by every input() result, kept in sync with the seats
+        self._public_fuuro: Dict[str, List[Tuple[str]]] = {}
+        self._public_kawa: Dict[str, List[Tuple[str, bool]]] = {}
+        self.rng = rng  # dedicated RNG for reproducible games (fuzzing); None uses the global one
         self.status = WAITING
+        self.state: TurnState = None
         self.yama : List[str] = []
 
         self.kyoutaku_number = 0
         self.tsumi_number = 0
-        if rules:
-            self.set_rules(rules)
+        self.set_rules(rules)
 
     def set_rules(self, rules: dict):
 
-        self.rules = default_rules
+        self.rules = dict(default_rules)  # copy, rooms may run different rule sets
         if rules is not None:
             self.rules.update(rules)
-        self.agari_judger = AgariJudger(self.rules['yaku_rules'])
+        self.agari_judger: AgariJudger = shared_judger(**self.rules['yaku_rules'])
 
     @property
-    def player_ids(self):
-        return list(self._players.keys())
+    def player_ids(self) -> List[str]:
+        return self._player_ids
+
+    def _update_seats(self):
+        self._player_ids[:] = [p.name for p in self._seats]
+        self._seat_of = {p.name: seat for seat, p in enumerate(self._seats)}
+        self._public_fuuro = {p.name: p.fuuro for p in self._seats}
+        self._public_kawa = {p.name: p.kawa for p in self._seats}
 
 
     @property
@@ -176,7 +208,7 @@ class ChinitsuGame:
         if cnt > len(self.yama):
             raise ValueError(f"Too few cards to draw! {cnt} > {len(self.yama)}")
         cards = self.yama[:cnt]
-        self._players[player_name].draw(cards)
+        self.player(player_name).draw(cards)
         self.yama = self.yama[cnt:]
         return cards
 
@@ -185,43 +217,45 @@ class ChinitsuGame:
             raise ValueError(f"Too few cards to draw! {len(self.yama)}")
 
         cards = [self.yama[-1]]
-        self._players[player_name].draw(cards)
+        self.player(player_name).draw(cards)
         self.yama = self.yama[:-1]
         return cards
 
     def player(self, player_name) -> ChinitsuPlayer:
-        return self._players[player_name]
+        return self._seats[self._seat_of[player_name]]
     def other_player(self, player_name) -> ChinitsuPlayer:
-        return self._players[self.player_ids[1 - self.player_ids.index(player_name)]]
+        return self._seats[1 - self._seat_of[player_name]]
 
     def start_new_game(self, debug_code=None):
         # randomly set oyabann (dealer)
-        idx = random.randint(0, 1)
+        idx = (self.rng or random).randint(0, 1)
         oya = self.player_ids[idx]
         self.start_game(oya, debug_code)
 
     def start_game(self, oya: str, debug_code=None):
 
-        if len(self._players) != 2:
+        if len(self._seats) != 2:
             raise ValueError(f"Too few or too many players! {self.player_ids}")
         self.state = TurnState(self.player_ids)
         self.state.current_player = oya
 
         # randomize the yama and draw cards
-        random.seed(time.time())
+        if self.rng is None:
+            random.seed(time.time())
+        rng = self.rng or random
         if not debug_code:
-            self.yama = ([f"{i}s" for i in range(1, 9+1)] * 4)[:]
-            random.shuffle(self.yama)
+            self.yama = list(ALL_TILES)
+            rng.shuffle(self.yama)
         else:   # debug mode
-            self.yama = debug_yama(debug_code)
+            self.yama = debug_yama(debug_code, rng)
 
 
-        for _, p in self._players.items():
+        for p in self._seats:
             p.reset_game()
 
-        ko  = self.player_ids[1 - self.player_ids.index(oya)]
-        self._players[oya].is_oya = True
-        self._players[ko].is_oya = False
+        ko  = self.player_ids[1 - self._seat_of[oya]]
+        self.player(oya).is_oya = True
+        self.player(ko).is_oya = False
 
         # simulate drawing cards just for fun :)
         for _ in range(3):
@@ -233,31 +267,39 @@ class ChinitsuGame:
 
 
     def add_player(self, player_name: str):
-        if len(self._players) >= 2:
-            raise AssertionError(f"Too many Players ({len(self._players)})!")
-        if player_name in self._players:
+        if len(self._seats) >= 2:
+            raise AssertionError(f"Too many Players ({len(self._seats)})!")
+        if player_name in self._seat_of:
             raise ValueError(f"{player_name} exists!")
-        self._players[player_name] = ChinitsuPlayer(player_name, initial_point=self.rules['initial_point'])
+        self._seats.append(ChinitsuPlayer(player_name, initial_point=self.rules['initial_point']))
+        self._update_seats()
 
     def activate_player(self, player_name):
-        if player_name not in self._players:
+        if player_name not in self._seat_of:
             raise ValueError(player_name)
-        self._players[player_name].active = True
+        self.player(player_name).active = True
 
     def deactivate_player(self, player_name):
-        if player_name not in self._players:
+        if player_name not in self._seat_of:
             raise ValueError(player_name)
-        self._players[player_name].active = False
+        self.player(player_name).active = False
 
     def remove_player(self, player_name: str):
         if self.is_running or self.is_reconnecting:
             raise AssertionError("Cannot remove player in game!")
-        if player_name not in self._players:
+        if player_name not in self._seat_of:
             raise ValueError(player_name)
-        self._players.pop(player_name)
+        self._seats.pop(self._seat_of[player_name])
+        self._update_seats()
 
 
     def input(self, action: str, card_idx: int, player_id: str) -> bool:
+        if not tracer.enabled:
+            return self._input(action, card_idx, player_id)
+        with tracer.span("ChinitsuGame.input", player=player_id, action=action):
+            return self._input(action, card_idx, player_id)
+
+    def _input(self, action: str, card_idx: int, player_id: str) -> bool:
 
         # public info to be retured to every connection
         public_info = {
@@ -265,51 +307,54 @@ class ChinitsuGame:
             "action" : action,
             "card_idx" : None,         # index of card played or drawn, depending on action
             "card" : None,
-            "fuuro" : {
-                name: p.fuuro for name, p in self._players.items()
-            },
-            "kawa" : {
-                name: p.kawa for name, p in self._players.items()
-            },
+            "fuuro" : self._public_fuuro,
+            "kawa" : self._public_kawa,
         }
 
          # start the game
         if action in ["start_new", "start"]:
-            debug_code = card_idx if card_idx and card_idx > 100 else None
+            debug_code = card_idx if card_idx and card_idx > 100 and card_idx in debug_cards else None
             if debug_code:
                 logger.warning('Debug code: %s', debug_code)
 
             is_new_game = (action == "start_new")
-            if len(self._players) == 2:
+            if len(self._seats) == 2:
                 self.start_new_game(debug_code=debug_code)
                 self.state.next() # oya does not need to draw, set to after_draw
                 res = {player_id: {"message": "ok"}}
-                for name, p in self._players.items():
-                    if name not in res:
-                        res[name] = {}
-                    res[name]["hand"] = p.hand
-                    res[name]["is_oya"] = p.is_oya
+                for p in self._seats:
+                    if p.name not in res:
+                        res[p.name] = {}
+                    res[p.name]["hand"] = p.hand
+                    res[p.name]["is_oya"] = p.is_oya
 
             else:
                 res = {player_id: {"message": "not_enough_players"}}
                 return res
+        elif action not in ["draw", "discard", "riichi", "kan", "tsumo", "ron", "skip_ron"]:
+            res = {player_id: {"message": "unknown_action"}}
+            return res
+        elif self.state is None:
+            res = {player_id: {"message": "game_not_started"}}
+            return res
 
 
 
-        p   = self.player(player_id)
-        opp = self.other_player(player_id)
-        is_tenchii_tenpai = (self.state.turn in [1, 2] and all([p.num_kan == 0 for _, p in self._players.items()]))
+        seat = self._seat_of[player_id]
+        p   = self._seats[seat]
+        opp = self._seats[1 - seat]
+        is_tenchii_tenpai = (self.state.turn in [1, 2] and p.num_kan == 0 and opp.num_kan == 0)
 
 
 
         # check if action turn is legal
-        if action in ["discard", "draw", "tsumo", "riichi", "kan"] and self.state.current_player != player_id:
+        if action in ["discard", "draw", "tsumo", "riichi", "kan"] and self.state.current_seat != seat:
             res = {player_id: {"message": "not_your_turn"}}
             return res
-        if action in ["ron", "skip_ron"] and self.state.current_player == player_id:
+        if action in ["ron", "skip_ron"] and self.state.current_seat == seat:
             res = {player_id: {"message": "not_opponent_turn"}}
             return res
-        if action in ["discard", "riichi", "kan"] and (card_idx is None or not (0 <= card_idx < 14 - self._players[player_id].num_kan)):
+        if action in ["discard", "riichi", "kan"] and (card_idx is None or not (0 <= card_idx < 14 - 3 * p.num_kan)):
             res = {player_id: {"message": "card_index_error"}}
             return res
 
@@ -333,6 +378,9 @@ class ChinitsuGame:
             if not self.state.is_after_draw:
                 res = {player_id: {"message": "illegal_kan"}}
                 return res
+            if len(self.yama) == 0:
+                res = {player_id: {"message": "no_rinshan_card"}}
+                return res
             kan_card = p.hand[card_idx] # kan card type
             if not p.kan(kan_card):
                 res = {player_id: {"message": f"too_few_cards_to_kan. ({kan_card})"}}
@@ -342,8 +390,8 @@ class ChinitsuGame:
 
             rinshan_card = self.draw_from_rinshan(player_id)
             # cancel ippatsu of all players after kan
-            for _, p in self._players.items():
-                p.is_ippatsu = False
+            for player in self._seats:
+                player.is_ippatsu = False
 
             res = {player_id: {"message": "ok", "hand": p.hand}}
 
@@ -397,8 +445,8 @@ class ChinitsuGame:
                     "point": agari.cost,
                     "yaku": [str(y) for y in agari.yaku]
                 })
-                self.player(player_id).is_oya = True
-                self.other_player(player_id).is_oya = False
+                p.is_oya = True
+                opp.is_oya = False
             else:
                 public_info.update({
                     "agari": False,
@@ -435,7 +483,8 @@ class ChinitsuGame:
 
             }
 
-            agari = self.agari_judger.judge(p.hand, p.fuuro, p.hand[-1], **agari_condition)
+            with (tracer.span("AgariJudger.judge") if tracer.enabled else NOOP):
+                agari = self.agari_judger.judge(p.hand, p.fuuro, p.hand[-1], **agari_condition)
             res = process_agari(agari)
 
 
@@ -465,7 +514,8 @@ class ChinitsuGame:
 
             }
 
-            agari = self.agari_judger.judge(p.hand, p.fuuro, opp.kawa[-1][0], **agari_condition)
+            with (tracer.span("AgariJudger.judge") if tracer.enabled else NOOP):
+                agari = self.agari_judger.judge(p.hand, p.fuuro, opp.kawa[-1][0], **agari_condition)
             res = process_agari(agari)
 
         # skip opponent turn (choose not to ron)
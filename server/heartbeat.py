@@ -0,0 +1,94 @@
+# pylint: disable=missing-function-docstring, missing-module-docstring, missing-class-docstring, line-too-long
+import asyncio, itertools, logging, time
+from typing import Awaitable, Callable, Dict
+from fastapi import WebSocket
+from metrics import Histogram
+from profiling import tracer, NOOP
+logger = logging.getLogger("uvicorn")
+
+HEARTBEAT_INTERVAL = 10.0  # seconds between two pings on the shared timer
+HEARTBEAT_TIMEOUT = 30.0   # silence (no pong, no message) after which a peer is dead
+rtt_bounds = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+class PeerState:
+    __slots__ = ("room_name", "player_id", "last_seen", "ping_seq", "ping_sent_at", "rtt")
+
+    def __init__(self, room_name: str, player_id: str) -> None:
+        self.room_name = room_name
+        self.player_id = player_id
+        self.last_seen = time.monotonic()
+        self.ping_seq: int = None       # outstanding ping, None once answered
+        self.ping_sent_at = 0.0
+        self.rtt = Histogram(rtt_bounds)
+
+
+class Heartbeat:
+    """
+    Application-level ping/pong over every registered connection, driven by one shared timer task.
+    Any inbound frame counts as liveness; peers silent for longer than `timeout` are handed to `on_dead`.
+    """
+    def __init__(self, on_dead: Callable[[WebSocket, str, str], Awaitable], interval: float = HEARTBEAT_INTERVAL, timeout: float = HEARTBEAT_TIMEOUT) -> None:
+        self.on_dead = on_dead
+        self.interval = interval
+        self.timeout = timeout
+        self.peers: Dict[WebSocket, PeerState] = {}
+        self.seq = itertools.count(1)
+        self._task: asyncio.Task = None
+
+    def register(self, websocket: WebSocket, room_name: str, player_id: str):
+        self.peers[websocket] = PeerState(room_name, player_id)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def unregister(self, websocket: WebSocket):
+        self.peers.pop(websocket, None)
+
+    def touch(self, websocket: WebSocket):
+        peer = self.peers.get(websocket)
+        if peer is not None:
+            peer.last_seen = time.monotonic()
+
+    def pong(self, websocket: WebSocket, info: dict):
+        peer = self.peers.get(websocket)
+        if peer is None or info.get("seq") != peer.ping_seq:
+            return  # stale or unknown pong
+        now = time.monotonic()
+        peer.rtt.observe(now - peer.ping_sent_at)
+        peer.last_seen = now
+        peer.ping_seq = None
+
+    async def _run(self):
+        while self.peers:
+            await asyncio.sleep(self.interval)
+            await self.tick()
+
+    async def tick(self):
+        now = time.monotonic()
+        for websocket, peer in list(self.peers.items()):
+            if now - peer.last_seen > self.timeout:
+                logger.warning(f"Heartbeat timeout: {peer.room_name} {peer.player_id}")
+                self.unregister(websocket)
+                await self.on_dead(websocket, peer.room_name, peer.player_id)
+                continue
+            if peer.ping_seq is not None and now - peer.ping_sent_at < self.timeout:
+                continue  # still waiting for the previous pong
+            peer.ping_seq = next(self.seq)
+            peer.ping_sent_at = now
+            try:
+                with (tracer.span("send", room=peer.room_name, player=peer.player_id) if tracer.enabled else NOOP):
+                    await websocket.send_json({"broadcast": False, "heartbeat": "ping", "seq": peer.ping_seq})
+            except Exception as e:
+                logger.error(f"Error in heartbeat: {e}")
+                self.unregister(websocket)
+                await self.on_dead(websocket, peer.room_name, peer.player_id)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        rooms: Dict[str, dict] = {}
+        for peer in self.peers.values():
+            rooms.setdefault(peer.room_name, {})[peer.player_id] = {
+                "idle": now - peer.last_seen,
+                "rtt": peer.rtt.snapshot(),
+            }
+        return {"connections": len(self.peers), "rooms": rooms}
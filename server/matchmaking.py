@@ -0,0 +1,101 @@
+# pylint: disable=missing-function-docstring, missing-module-docstring, missing-class-docstring, line-too-long
+import asyncio, logging, secrets, time
+from collections import OrderedDict
+from typing import Dict, Tuple
+from metrics import Histogram
+logger = logging.getLogger("uvicorn")
+
+# rule overrides on top of game.default_rules, selectable by name when queueing
+rule_sets = {
+    "default": {},
+}
+RATING_BAND = 200
+CLAIM_TIMEOUT = 60.0  # seconds a matched room waits for its first player before it is released
+
+
+class MatchTicket:
+    __slots__ = ("player_id", "shard", "enqueued_at", "future")
+
+    def __init__(self, player_id: str, shard: Tuple[int, str]) -> None:
+        self.player_id = player_id
+        self.shard = shard
+        self.enqueued_at = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class MatchQueue:
+    """
+    In-memory pairing queue sharded by (rating band, rule set).
+    Every shard is an OrderedDict used as a FIFO, so enqueue, cancel and pairing are all O(1).
+    Matched pairs get a freshly allocated room in the GameManager, reserved for the two of them; the room name is
+    delivered through the ticket future. The reservation (and the room's rules) holds until both players have joined
+    or `claim_timeout` runs out; an empty room is released at that point.
+    """
+    def __init__(self, game_manager, rating_band: int = RATING_BAND, claim_timeout: float = CLAIM_TIMEOUT) -> None:
+        self.game_manager = game_manager
+        self.rating_band = rating_band
+        self.claim_timeout = claim_timeout
+        self.shards: Dict[Tuple[int, str], OrderedDict] = {}
+        self.tickets: Dict[str, MatchTicket] = {}
+        self.wait_time: Dict[str, Histogram] = {}
+
+    def shard_key(self, rating: int, rule_set: str) -> Tuple[int, str]:
+        if rule_set not in rule_sets:
+            raise KeyError(rule_set)
+        return (rating // self.rating_band, rule_set)
+
+    def enqueue(self, player_id: str, rating: int = 1500, rule_set: str = "default") -> MatchTicket:
+        if player_id in self.tickets:
+            raise ValueError(f"{player_id} is already queued!")
+        key = self.shard_key(rating, rule_set)
+        ticket = MatchTicket(player_id, key)
+        shard = self.shards.get(key)
+        if shard:
+            _, opponent = shard.popitem(last=False)
+            del self.tickets[opponent.player_id]
+            if not shard:
+                del self.shards[key]
+            self._pair(opponent, ticket)
+        else:
+            self.shards.setdefault(key, OrderedDict())[player_id] = ticket
+            self.tickets[player_id] = ticket
+        return ticket
+
+    def cancel(self, player_id: str):
+        ticket = self.tickets.pop(player_id, None)
+        if ticket is None:
+            return
+        shard = self.shards[ticket.shard]
+        del shard[player_id]
+        if not shard:
+            del self.shards[ticket.shard]
+        if not ticket.future.done():
+            ticket.future.cancel()
+
+    def cancel_all(self):
+        for player_id in list(self.tickets):
+            self.cancel(player_id)
+
+    def _pair(self, first: MatchTicket, second: MatchTicket):
+        band, rule_set = first.shard
+        room_name = f"match-{secrets.token_urlsafe(12)}"  # unguessable, only the matched players learn it
+        self.game_manager.reserve(room_name, (first.player_id, second.player_id), rules=rule_sets[rule_set])
+        self.game_manager.init_game(room_name, rules=rule_sets[rule_set])
+        asyncio.get_running_loop().call_later(self.claim_timeout, self.game_manager.release_unclaimed, room_name)
+        now = time.monotonic()
+        hist = self.wait_time.setdefault(rule_set, Histogram())
+        for ticket in (first, second):
+            hist.observe(now - ticket.enqueued_at)
+            ticket.future.set_result(room_name)
+        logger.info(f"Matched {first.player_id} vs {second.player_id} in {room_name}")
+
+    @property
+    def num_waiting(self):
+        return len(self.tickets)
+
+    def stats(self) -> dict:
+        return {
+            "waiting": self.num_waiting,
+            "shards": {f"{band * self.rating_band}-{rule_set}": len(shard) for (band, rule_set), shard in self.shards.items()},
+            "wait_time": {rule_set: hist.snapshot() for rule_set, hist in self.wait_time.items()},
+        }
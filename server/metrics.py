@@ -0,0 +1,50 @@
+# pylint: disable=missing-function-docstring, missing-module-docstring, missing-class-docstring, line-too-long
+from bisect import bisect_left
+from typing import List
+
+# seconds; roughly x2.5 steps from 10ms to 10min
+default_bounds = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 150, 300, 600]
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. `counts[i]` counts samples <= bounds[i], the last slot counts the overflow.
+    """
+    def __init__(self, bounds: List[float] = None) -> None:
+        self.bounds = list(bounds or default_bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float):
+        """
+        Upper bound of the bucket holding the q-th sample (None if empty).
+        """
+        if self.total == 0:
+            return None
+        rank = q * self.total
+        seen = 0
+        for i, cnt in enumerate(self.counts):
+            seen += cnt
+            if seen >= rank and cnt:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.total,
+            "sum": self.sum,
+            "max": self.max,
+            "mean": self.sum / self.total if self.total else None,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": {("+inf" if i == len(self.bounds) else str(self.bounds[i])): cnt for i, cnt in enumerate(self.counts)},
+        }
@@ -0,0 +1,148 @@
+# pylint: disable=missing-function-docstring, missing-module-docstring, missing-class-docstring, line-too-long
+import asyncio, contextvars, json, logging, os, sys, tempfile, threading, time
+from collections import Counter
+from contextlib import nullcontext
+from typing import Dict, List
+logger = logging.getLogger("uvicorn")
+
+TRACE_DIR = os.environ.get("CHINITSU_TRACE_DIR", os.path.join(tempfile.gettempdir(), "chinitsu-traces"))
+MAX_TRACE_EVENTS = 1_000_000
+
+# hot paths use `with (tracer.span(...) if tracer.enabled else NOOP):`, so a disabled tracer costs one attribute check
+NOOP = nullcontext()
+_span_tags: contextvars.ContextVar = contextvars.ContextVar("span_tags", default={})
+
+
+class Span:
+    __slots__ = ("tracer", "name", "tags", "start", "token")
+
+    def __init__(self, tracer: "Tracer", name: str, tags: dict) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self):
+        self.token = _span_tags.set(self.tags)  # nested spans inherit room/player/action
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        _span_tags.reset(self.token)
+        self.tracer.record(self.name, self.tags, self.start, end)
+        return False
+
+
+class Tracer:
+    """
+    Records spans as Chrome trace events ("X" events, one lane per room), viewable in chrome://tracing or Perfetto.
+    """
+    def __init__(self) -> None:
+        self.enabled = False
+        self.room: str = None   # only trace this room, if set
+        self.path: str = None
+        self.events: List[dict] = []
+        self.lanes: Dict[str, int] = {}
+        self.origin = 0
+
+    def start(self, room: str = None) -> str:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        self.path = os.path.join(TRACE_DIR, f"trace-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.json")
+        self.room = room
+        self.events = []
+        self.lanes = {}
+        self.origin = time.perf_counter_ns()
+        self.enabled = True
+        logger.warning(f"Tracing{f' room {room}' if room else ''} to {self.path}")
+        return self.path
+
+    def stop(self) -> asyncio.Future:
+        """
+        Stop recording and hand the buffer to a worker thread for writing, keeping the (up to
+        MAX_TRACE_EVENTS) serialization off the event loop. Returns the write's future, if any.
+        """
+        if not self.enabled:
+            return None
+        self.enabled = False
+        path, events, lanes = self.path, self.events, self.lanes
+        self.events = []
+        self.lanes = {}
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:  # not called from the server, write in place
+            self._write(path, events, lanes)
+            return None
+        return loop.run_in_executor(None, self._write, path, events, lanes)
+
+    @staticmethod
+    def _write(path: str, events: List[dict], lanes: Dict[str, int]):
+        pid = os.getpid()
+        meta = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": lane}} for lane, tid in lanes.items()]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": meta + events, "displayTimeUnit": "ms"}, f)
+        logger.warning(f"Trace written: {path} ({len(events)} spans)")
+
+    def span(self, name: str, **tags):
+        tags = {**_span_tags.get(), **tags}
+        if self.room is not None and tags.get("room") != self.room:
+            return NOOP
+        return Span(self, name, tags)
+
+    def record(self, name: str, tags: dict, start: int, end: int):
+        if not self.enabled or len(self.events) >= MAX_TRACE_EVENTS:
+            return
+        lane = tags.get("room", "server")
+        if lane not in self.lanes:
+            self.lanes[lane] = len(self.lanes) + 1
+        self.events.append({"name": name, "ph": "X", "pid": os.getpid(), "tid": self.lanes[lane],
+                            "ts": (start - self.origin) / 1000, "dur": (end - start) / 1000, "args": tags})
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread (the event loop) from a helper thread and writes collapsed stacks
+    ("frame;frame;frame count" lines), the input format of flamegraph.pl and speedscope.
+    """
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.path: str = None
+        self._thread: threading.Thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, thread_id: int = None) -> str:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        self.path = os.path.join(TRACE_DIR, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.folded")
+        self._stop.clear()
+        target = thread_id if thread_id is not None else threading.get_ident()
+        self._thread = threading.Thread(target=self._run, args=(target, seconds), name="sampling-profiler", daemon=True)
+        self._thread.start()
+        logger.warning(f"Profiling for {seconds}s to {self.path}")
+        return self.path
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, thread_id: int, seconds: float):
+        stacks: Counter = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)  # pylint: disable=protected-access
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                stacks[";".join(reversed(stack))] += 1
+        with open(self.path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.warning(f"Profile written: {self.path} ({sum(stacks.values())} samples)")
+
+
+tracer = Tracer()
+profiler = SamplingProfiler()
@@ -0,0 +1,196 @@
+# pylint: disable=missing-function-docstring, missing-module-docstring, missing-class-docstring, line-too-long
+"""
+Replay a traffic capture (see capture.py) against a server and diff the responses.
+
+    CHINITSU_CAPTURE=prod.jsonl python start_server.py     # record
+    python replay.py prod.jsonl --spawn --speed max         # replay against an in-process app
+    python replay.py prod.jsonl --url ws://127.0.0.1:8000 --speed 10
+
+Inbound frames are sent at their recorded time divided by --speed ("max": no waiting). Before each
+frame the replayer waits until every session received the responses recorded up to that point, so
+the interleaving of sessions is preserved at any speed. With --spawn the rooms reuse their recorded
+shuffle seeds and rules, so deals (and hence every response) should match exactly; against an external server
+hands will differ.
+"""
+import argparse, asyncio, json, logging, math, socket, sys, time
+from collections import deque
+from typing import Dict, List
+from capture import load_capture
+
+logger = logging.getLogger("uvicorn")
+
+
+class ReplaySession:
+    def __init__(self, session: int, room_name: str, player_id: str) -> None:
+        self.session = session
+        self.room_name = room_name
+        self.player_id = player_id
+        self.websocket = None
+        self.reader: asyncio.Task = None
+        self.expected: List = []
+        self.received: List = []
+
+    def __str__(self):
+        return f"session {self.session} ({self.room_name}/{self.player_id})"
+
+
+class Replayer:
+    def __init__(self, events: List[dict], url: str, speed: float, timeout: float) -> None:
+        self.events = events
+        self.url = url.rstrip("/")
+        self.speed = speed
+        self.timeout = timeout
+        self.sessions: Dict[int, ReplaySession] = {}
+        self.progress = asyncio.Event()
+        self.divergences: List[str] = []
+
+    async def _read(self, rs: ReplaySession):
+        try:
+            async for message in rs.websocket:
+                try:
+                    data = json.loads(message)
+                except ValueError:
+                    data = message
+                if isinstance(data, dict) and data.get("heartbeat") == "ping":
+                    await rs.websocket.send(json.dumps({"heartbeat": "pong", "seq": data["seq"]}))
+                    continue
+                rs.received.append(data)
+                self.progress.set()
+        except Exception as e:  # pylint: disable=broad-except
+            logger.info(f"{rs} reader stopped: {e}")
+
+    async def _catch_up(self, expected_counts: Dict[int, int]):
+        """
+        Wait until every session received the frames recorded so far (or the timeout expires).
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            behind = [rs for s_id, rs in self.sessions.items() if len(rs.received) < expected_counts.get(s_id, 0)]
+            if not behind:
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                for rs in behind:
+                    self.divergences.append(f"{rs}: timed out waiting for frame #{len(rs.received)}")
+                    # do not wait for this frame again
+                    rs.received.extend([None] * (expected_counts[rs.session] - len(rs.received)))
+                return
+            self.progress.clear()
+            try:
+                await asyncio.wait_for(self.progress.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self) -> List[str]:
+        import websockets  # pylint: disable=import-outside-toplevel
+
+        expected_counts: Dict[int, int] = {}
+        start = time.monotonic()
+        t0 = self.events[0]["t"] if self.events else 0.0
+        for event in self.events:
+            kind = event["event"]
+            if kind == "out":
+                if event["session"] in self.sessions:
+                    self.sessions[event["session"]].expected.append(event["data"])
+                expected_counts[event["session"]] = expected_counts.get(event["session"], 0) + 1
+                continue
+            if kind not in ("open", "in", "close"):
+                continue
+
+            await self._catch_up(expected_counts)
+            if not math.isinf(self.speed):
+                delay = start + (event["t"] - t0) / self.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            if kind == "open":
+                rs = ReplaySession(event["session"], event["room"], event["player"])
+                rs.websocket = await websockets.connect(f"{self.url}/ws/{rs.room_name}/{rs.player_id}")
+                rs.reader = asyncio.ensure_future(self._read(rs))
+                self.sessions[rs.session] = rs
+            elif event["session"] not in self.sessions:
+                continue  # capture started while the session was already open
+            elif kind == "in":
+                await self.sessions[event["session"]].websocket.send(json.dumps(event["data"]))
+            elif kind == "close":
+                await self.sessions[event["session"]].websocket.close()
+
+        await self._catch_up(expected_counts)
+        await asyncio.sleep(min(self.timeout, 0.2))  # let unexpected trailing frames arrive
+        # our own closes below make the server broadcast departures, which were never recorded
+        final = {s_id: len(rs.received) for s_id, rs in self.sessions.items()}
+        for rs in self.sessions.values():
+            await rs.websocket.close()
+            await rs.reader
+            del rs.received[final[rs.session]:]
+            self._diff(rs)
+        return self.divergences
+
+    def _diff(self, rs: ReplaySession):
+        for i, (want, got) in enumerate(zip(rs.expected, rs.received)):
+            if got is not None and want != got:
+                self.divergences.append(f"{rs} frame #{i}:\n    recorded: {want}\n    replayed: {got}")
+        if len(rs.received) > len(rs.expected):
+            self.divergences.append(f"{rs}: {len(rs.received) - len(rs.expected)} unexpected extra frames, first: {rs.received[len(rs.expected)]}")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def spawn_server(events: List[dict]):
+    """
+    Serve the app in-process, setting up rooms with the recorded shuffle seeds and rules.
+    """
+    import uvicorn  # pylint: disable=import-outside-toplevel
+    import server  # pylint: disable=import-outside-toplevel
+    for event in events:
+        if event["event"] == "room":
+            server.gm.replay_rooms.setdefault(event["room"], deque()).append((event["seed"], event.get("rules")))
+    port = free_port()
+    srv = uvicorn.Server(uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.ensure_future(srv.serve())
+    while not srv.started:
+        await asyncio.sleep(0.01)
+    return srv, task, f"ws://127.0.0.1:{port}"
+
+
+async def main_async(args) -> int:
+    events = load_capture(args.capture)
+    speed = math.inf if args.speed == "max" else float(args.speed)
+    srv = task = None
+    url = args.url
+    if args.spawn:
+        srv, task, url = await spawn_server(events)
+
+    began = time.perf_counter()
+    divergences = await Replayer(events, url, speed, args.timeout).run()
+    elapsed = time.perf_counter() - began
+    num_in = sum(e["event"] == "in" for e in events)
+    print(f"replayed {num_in} frames of {sum(e['event'] == 'open' for e in events)} sessions in {elapsed:.2f}s "
+          f"(recorded span {events[-1]['t'] - events[0]['t'] if events else 0:.2f}s, speed {args.speed})")
+    for d in divergences:
+        print(f"DIVERGED {d}")
+    print(f"{len(divergences)} divergences")
+
+    if srv is not None:
+        srv.should_exit = True
+        await task
+    return 1 if divergences else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true", help="replay against an in-process instance of the app")
+    parser.add_argument("--speed", default="1", help='time scale, e.g. 1, 10 or "max"')
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds to wait for a recorded response")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
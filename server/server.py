@@ -1,26 +1,97 @@
 # pylint: disable=missing-function-docstring, missing-module-docstring, missing-class-docstring, line-too-long, logging-fstring-interpolation
-import logging
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import asyncio, logging, os, random, secrets, signal, threading
+from collections import deque
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from typing import List, Dict
 from game import ChinitsuGame
+from matchmaking import MatchQueue
+from heartbeat import Heartbeat
+from capture import TrafficRecorder
+from profiling import tracer, profiler, NOOP
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    install_drain_handler()
+    yield
+    if manager.recorder is not None:
+        manager.recorder.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 logger = logging.getLogger("uvicorn")
 # logger.warn("Game Logger Active")
 
+class Reservation:
+    __slots__ = ("player_ids", "rules", "claimed")
+
+    def __init__(self, player_ids: tuple, rules: Dict=None) -> None:
+        self.player_ids = tuple(player_ids)
+        self.rules = rules
+        self.claimed = False  # both players have joined
+
+
 class GameManager:
     def __init__(self) -> None:
         self.games = dict()
+        self.recorder: TrafficRecorder = None
+        self.replay_rooms: Dict[str, deque] = {}  # replay: (seed, rules) to hand out per room name, in order
+        self.reservations: Dict[str, Reservation] = {}  # matchmaking: room name -> who may join, with which rules
 
-    def init_game(self, room_name):
+    def init_game(self, room_name, rules: Dict=None):
         if room_name not in self.games:
-            self.games[room_name] = ChinitsuGame()
+            if room_name in self.reservations:  # also when a matched room is recreated after its host left
+                rules = self.reservations[room_name].rules
+            rng, rules = self.room_setup(room_name, rules)
+            self.games[room_name] = ChinitsuGame(rules, rng=rng)
             return True
         return False  # Game already started
 
+    def room_setup(self, room_name, rules: Dict=None):
+        """
+        Seeded RNG while capturing or replaying traffic, so deals can be reproduced (None otherwise).
+        When replaying, the recorded rules replace `rules` as well.
+        """
+        recorded = self.replay_rooms.get(room_name)
+        if recorded:
+            seed, rules = recorded.popleft()
+        elif self.recorder is not None:
+            seed = random.randrange(1 << 63)
+        else:
+            return None, rules
+        if self.recorder is not None:
+            self.recorder.room(room_name, seed, rules)
+        return random.Random(seed), rules
+
+    def reserve(self, room_name, player_ids: tuple, rules: Dict=None):
+        self.reservations[room_name] = Reservation(player_ids, rules)
+
+    def is_reserved_for_others(self, room_name, player_id) -> bool:
+        return room_name in self.reservations and player_id not in self.reservations[room_name].player_ids
+
+    def claim(self, room_name):
+        if room_name in self.reservations:
+            self.reservations[room_name].claimed = True
+
+    def release_unclaimed(self, room_name):
+        """
+        Claim deadline: drop the reservation unless both players joined, and end the room if nobody is in it.
+        """
+        reservation = self.reservations.get(room_name)
+        if reservation is None or reservation.claimed:
+            return
+        logger.info(f"Releasing unclaimed room {room_name}")
+        del self.reservations[room_name]
+        cur_game = self.games.get(room_name)
+        if cur_game is not None and not cur_game.player_ids:
+            self.end_game(room_name)
+
     def end_game(self, room_name):
         if room_name in self.games:
             del self.games[room_name]
+        # an unclaimed reservation outlives the room, so the opponent can still join after the host left
+        reservation = self.reservations.get(room_name)
+        if reservation is not None and reservation.claimed:
+            del self.reservations[room_name]
 
     def get_game(self, room_name) -> ChinitsuGame:
         return self.games.get(room_name, None)
@@ -31,8 +102,18 @@ class ConnectionManager:
         self.active_connections: Dict[str, List[WebSocket]] = {}
         self.connection_owner : Dict[WebSocket, str] = {}
         self.game_manager = game_manager
+        self.recorder: TrafficRecorder = None
+        self.draining = False  # set on SIGTERM: only existing rooms accept (re)connections
 
     async def connect(self, websocket: WebSocket, room_name: str, player_id: str):
+        if self.draining and self.game_manager.get_game(room_name) is None:
+            await websocket.accept()
+            await websocket.close(code=1003, reason="server_draining")
+            return False
+        if self.game_manager.is_reserved_for_others(room_name, player_id):
+            await websocket.accept()
+            await websocket.close(code=1003, reason="room_reserved")
+            return False
         if room_name in self.active_connections:
             if len(self.active_connections[room_name]) >= 2:
                 err_msg = "room_full"
@@ -51,6 +132,8 @@ class ConnectionManager:
             self.active_connections[room_name] = []
         self.active_connections[room_name].append(websocket)
         self.connection_owner[websocket] = player_id
+        if self.recorder is not None:
+            self.recorder.open(websocket, room_name, player_id)
 
         # Initialize game for the first player (host)
         if len(self.active_connections[room_name]) == 1:
@@ -66,28 +149,36 @@ class ConnectionManager:
             else:
                 cur_game.add_player(player_id)
                 cur_game.set_running()
+                self.game_manager.claim(room_name)
                 await self.broadcast(f"{player_id} joins {room_name}. Game START!", room_name)
 
 
         return True
 
-    def disconnect(self, websocket: WebSocket, room_name: str, player_id: str):
+    def disconnect(self, websocket: WebSocket, room_name: str, player_id: str) -> bool:
+        """
+        Drop websocket from room_name; returns False if it was already dropped (e.g. by the heartbeat).
+        """
+        if self.recorder is not None:
+            self.recorder.close(websocket)  # before the "left the room" broadcast, which replay sends after the close
+        if room_name not in self.active_connections or websocket not in self.active_connections[room_name]:
+            return False
         logger.info(f"Disconnected: {room_name} {player_id}")
-        if room_name in self.active_connections:
-            self.active_connections[room_name].remove(websocket)
-            cur_game = self.game_manager.get_game(room_name)
-            if cur_game.is_running:
-                cur_game.deactivate_player(player_id)
-                cur_game.set_reconnecting()
-            elif cur_game.is_waiting or cur_game.is_ended:
-                cur_game.remove_player(player_id)
+        self.active_connections[room_name].remove(websocket)
+        cur_game = self.game_manager.get_game(room_name)
+        if cur_game.is_running:
+            cur_game.deactivate_player(player_id)
+            cur_game.set_reconnecting()
+        elif cur_game.is_waiting or cur_game.is_ended:
+            cur_game.remove_player(player_id)
 
 
-            if len(self.active_connections[room_name]) == 0:
-                self.game_manager.end_game(room_name)
-                del self.active_connections[room_name]
+        if len(self.active_connections[room_name]) == 0:
+            self.game_manager.end_game(room_name)
+            del self.active_connections[room_name]
 
-            self.connection_owner[websocket] = None
+        self.connection_owner.pop(websocket, None)
+        return True
 
 
     async def broadcast(self, message: str, room_name: str):
@@ -98,7 +189,11 @@ class ConnectionManager:
             return
         for connection in self.active_connections[room_name]:
             try:
-                await connection.send_json({"broadcast":True, "message": message})
+                info = {"broadcast":True, "message": message}
+                with (tracer.span("send", room=room_name, player=self.connection_owner[connection]) if tracer.enabled else NOOP):
+                    await connection.send_json(info)
+                if self.recorder is not None:
+                    self.recorder.outbound(connection, info)
             except Exception as e:
                 logger.error(f"Error in broadcast: {e}")
                 self.disconnect(connection, room_name, self.connection_owner[connection])
@@ -112,7 +207,10 @@ class ConnectionManager:
             return
         for connection in self.active_connections[room_name]:
             if self.connection_owner[connection] == player_id:
-                await connection.send_text(message)
+                with (tracer.span("send", room=room_name, player=player_id) if tracer.enabled else NOOP):
+                    await connection.send_text(message)
+                if self.recorder is not None:
+                    self.recorder.outbound(connection, message)
 
     async def send_dict_to(self, info: dict, room_name: str, player_id: str):
         """
@@ -125,7 +223,10 @@ class ConnectionManager:
         for connection in self.active_connections[room_name]:
             if self.connection_owner[connection] == player_id:
                 try:
-                    await connection.send_json(info)
+                    with (tracer.span("send", room=room_name, player=player_id) if tracer.enabled else NOOP):
+                        await connection.send_json(info)
+                    if self.recorder is not None:
+                        self.recorder.outbound(connection, info)
                 except Exception as e:
                     logger.error(f"Error in send_dict_to: {e}")
                     self.disconnect(connection, room_name, player_id)
@@ -134,6 +235,12 @@ class ConnectionManager:
         """
         Take action from clientside input
         """
+        if not tracer.enabled:
+            return await self._game_action(info, room_name, player_id)
+        with tracer.span("ConnectionManager.game_action", room=room_name, player=player_id, action=info.get("action")):
+            return await self._game_action(info, room_name, player_id)
+
+    async def _game_action(self, info: dict, room_name: str, player_id: str):
         if room_name not in self.active_connections:
             return
         cur_game = self.game_manager.get_game(room_name)
@@ -152,19 +259,200 @@ class ConnectionManager:
 
 gm = GameManager()
 manager = ConnectionManager(gm)
+matchmaker = MatchQueue(gm)
+# the queue is per process, so start_server.py turns matchmaking off when running several workers
+MATCHMAKING = os.environ.get("CHINITSU_MATCHMAKING", "1") != "0"
+
+# CHINITSU_CAPTURE=<file.jsonl> records every /ws session for replay.py
+if os.environ.get("CHINITSU_CAPTURE"):
+    gm.recorder = manager.recorder = TrafficRecorder(os.environ["CHINITSU_CAPTURE"])
+
+
+async def drop_dead_peer(websocket: WebSocket, room_name: str, player_id: str):
+    """
+    Heartbeat timeout: treat like a disconnect (running games go to RECONNECT) and close the socket.
+    """
+    if manager.disconnect(websocket, room_name, player_id):
+        await manager.broadcast(f"{player_id} left the room {room_name}", room_name)
+    try:
+        await websocket.close(code=1001, reason="heartbeat_timeout")
+    except Exception as e:
+        logger.info(f"Closing dead peer {room_name} {player_id}: {e}")
+
+heartbeat = Heartbeat(on_dead=drop_dead_peer)
+
+# seconds a SIGTERM waits for running rooms to empty before shutting down anyway
+DRAIN_TIMEOUT = float(os.environ.get("CHINITSU_DRAIN_TIMEOUT", 600))
+
+
+def begin_drain():
+    manager.draining = True
+    matchmaker.cancel_all()
+
+
+async def drain_then_exit(exit_handler, timeout: float):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while manager.active_connections and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.5)
+    if manager.active_connections:
+        logger.warning(f"Drain timeout, closing {len(manager.active_connections)} rooms")
+    else:
+        logger.warning("Drained all rooms")
+    exit_handler(signal.SIGTERM, None)
+
+
+def install_drain_handler():
+    """
+    Turn the first SIGTERM into a graceful drain: refuse new rooms and let the running ones finish (or time out)
+    before handing the signal on to the server (uvicorn). A second SIGTERM to this process shuts down right away;
+    with several workers that means signalling the worker, as uvicorn's supervisor waits for its workers and ignores it.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return  # e.g. TestClient, no signals to handle
+    exit_handler = signal.getsignal(signal.SIGTERM)
+    if not callable(exit_handler):
+        return
+
+    def on_sigterm():
+        if manager.draining:
+            exit_handler(signal.SIGTERM, None)
+            return
+        logger.warning(f"SIGTERM: draining {len(manager.active_connections)} rooms (timeout {DRAIN_TIMEOUT:.0f}s)")
+        begin_drain()
+        asyncio.ensure_future(drain_then_exit(exit_handler, DRAIN_TIMEOUT))
+
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, on_sigterm)
+    except NotImplementedError:  # windows
+        pass
 
 
 @app.websocket("/ws/{room_name}/{player_id}")
 async def websocket_endpoint(websocket: WebSocket, room_name: str, player_id: str):
     if not await manager.connect(websocket, room_name, player_id):
         return
+    heartbeat.register(websocket, room_name, player_id)
 
     try:
         while True:
 
             data = await websocket.receive_json()
+            heartbeat.touch(websocket)
+            if data.get("heartbeat") == "pong":
+                heartbeat.pong(websocket, data)
+                continue
+            if manager.recorder is not None:
+                manager.recorder.inbound(websocket, data)
             # await manager.broadcast(f"{player_id}: {data}", room_name)
             await manager.game_action(data, room_name, player_id)
     except WebSocketDisconnect:
-        manager.disconnect(websocket, room_name, player_id)
-        await manager.broadcast(f"{player_id} left the room {room_name}", room_name)
+        if manager.disconnect(websocket, room_name, player_id):
+            await manager.broadcast(f"{player_id} left the room {room_name}", room_name)
+    finally:
+        heartbeat.unregister(websocket)
+        if manager.recorder is not None:
+            manager.recorder.close(websocket)
+
+
+
+@app.websocket("/match/{player_id}")
+async def match_endpoint(websocket: WebSocket, player_id: str, rating: int = 1500, rules: str = "default"):
+    """
+    Wait in the matchmaking queue; replies with the allocated room, then the client connects to /ws/{room_name}/{player_id}.
+    """
+    await websocket.accept()
+    if not MATCHMAKING:
+        await websocket.close(code=1003, reason="matchmaking_disabled")
+        return
+    if manager.draining:
+        await websocket.close(code=1003, reason="server_draining")
+        return
+    try:
+        ticket = matchmaker.enqueue(player_id, rating, rules)
+    except (KeyError, ValueError) as e:
+        await websocket.close(code=1003, reason=f"match_error: {e}")
+        return
+
+    # a closing client socket is only noticed by reading from it
+    recv_task = asyncio.ensure_future(websocket.receive())
+    while not ticket.future.done():
+        await asyncio.wait([ticket.future, recv_task], return_when=asyncio.FIRST_COMPLETED)
+        if recv_task.done():
+            if recv_task.result()["type"] == "websocket.disconnect":
+                matchmaker.cancel(player_id)
+                return
+            recv_task = asyncio.ensure_future(websocket.receive())
+    recv_task.cancel()
+    if ticket.future.cancelled():
+        await websocket.close(code=1003, reason="server_draining")
+        return
+    await websocket.send_json({"broadcast": False, "message": "matched", "room_name": ticket.future.result()})
+    await websocket.close()
+
+
+@app.get("/match/stats")
+async def match_stats():
+    return matchmaker.stats()
+
+
+@app.get("/heartbeat/stats")
+async def heartbeat_stats():
+    return heartbeat.stats()
+
+
+def check_admin(request: Request):
+    """
+    Admin endpoints only exist when CHINITSU_ADMIN_TOKEN is set, and need it in the X-Admin-Token header.
+    """
+    expected = os.environ.get("CHINITSU_ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(request.headers.get("X-Admin-Token", ""), expected):
+        raise HTTPException(status_code=403, detail="admin_token_invalid")
+
+
+MAX_ADMIN_SECONDS = 300
+trace_timer: asyncio.TimerHandle = None
+
+
+@app.post("/admin/profile")
+async def start_profile(request: Request, seconds: float = Query(10, gt=0, le=MAX_ADMIN_SECONDS)):
+    """
+    Sample the event loop thread for `seconds`; the collapsed stacks are written to the returned file.
+    """
+    check_admin(request)
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="profiler_running")
+    return {"output": profiler.start(seconds), "seconds": seconds}
+
+
+@app.delete("/admin/profile")
+async def stop_profile(request: Request):
+    check_admin(request)
+    profiler.stop()
+    return {"output": profiler.path}
+
+
+@app.post("/admin/trace")
+async def start_trace(request: Request, seconds: float = Query(10, gt=0, le=MAX_ADMIN_SECONDS), room: str = None):
+    """
+    Record spans (optionally for one room only) for `seconds` into the returned Chrome trace file.
+    """
+    global trace_timer  # pylint: disable=global-statement
+    check_admin(request)
+    if tracer.enabled:
+        raise HTTPException(status_code=409, detail="tracer_running")
+    path = tracer.start(room)
+    trace_timer = asyncio.get_running_loop().call_later(seconds, tracer.stop)
+    return {"output": path, "seconds": seconds, "room": room}
+
+
+@app.delete("/admin/trace")
+async def stop_trace(request: Request):
+    check_admin(request)
+    if trace_timer is not None:
+        trace_timer.cancel()
+    written = tracer.stop()
+    if written is not None:
+        await written
+    return {"output": tracer.path}
@@ -1,18 +1,85 @@
+"""
+Launch the chinitsu server.
+
+    python start_server.py --host 0.0.0.0 --port 8000 --workers 1 --loop auto --http auto
+
+SIGTERM drains: new rooms are refused while running rooms finish, for at most --drain-timeout seconds.
+A second SIGTERM to the process stops it right away; with --workers > 1 the supervisor ignores it while
+waiting for the draining workers, so signal the worker PIDs instead.
+
+Rooms and the matchmaking queue live in process memory. With --workers > 1 both players of a room must
+reach the same worker (e.g. a proxy hashing on the room name), and /match is disabled: each worker would
+pair only its own players, and a matched room name could be routed to a worker that never allocated it.
+"""
+# pylint: disable=missing-function-docstring, line-too-long
+import argparse, copy, importlib.util, logging, os, sys
 import uvicorn
-logging_config = uvicorn.config.LOGGING_CONFIG
-
-logging_config["loggers"]["game_log"] = {
-    "handlers": ["default"],
-    "level": "INFO",
-    "propagate": False,
-}
-logging_config["handlers"]["game_log"] = {
-    "formatter": "default",
-    "class": "my_project.ColorStreamHandler",
-    "stream": "ext://sys.stderr", 
-}
+
+logger = logging.getLogger("uvicorn")
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# preferred implementation first, the last one is always available with plain uvicorn
+LOOPS = {"uvloop": "uvloop", "asyncio": None}
+HTTP_PARSERS = {"httptools": "httptools", "h11": "h11"}
+WS_PROTOCOLS = {"websockets": "websockets", "websockets-sansio": "websockets", "wsproto": "wsproto"}  # parse the game's frames
+
+
+def available(module) -> bool:
+    return module is None or importlib.util.find_spec(module) is not None
+
+
+def pick(kind: str, choice: str, options: dict) -> str:
+    """
+    Resolve "auto" to the first installed option; fall back (with a warning) if the requested one is missing.
+    """
+    if choice != "auto":
+        if available(options[choice]):
+            return choice
+        logger.warning(f"{kind} '{choice}' is not installed, falling back")
+    for name, module in options.items():
+        if available(module):
+            return name
+    raise RuntimeError(f"No {kind} implementation installed (tried {', '.join(options)})")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.environ.get("CHINITSU_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("CHINITSU_PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("CHINITSU_WORKERS", 1)))
+    parser.add_argument("--loop", choices=["auto", *LOOPS], default="auto")
+    parser.add_argument("--http", choices=["auto", *HTTP_PARSERS], default="auto")
+    parser.add_argument("--ws", choices=["auto", *WS_PROTOCOLS], default="auto", help="passed through to uvicorn")
+    parser.add_argument("--drain-timeout", type=float, default=600, help="seconds SIGTERM waits for running rooms")
+    parser.add_argument("--capture", default=None, help="record /ws traffic to this file (see replay.py)")
+    parser.add_argument("--log-level", default="info")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:     %(message)s")  # until uvicorn sets up logging
+    loop = pick("event loop", args.loop, LOOPS)
+    http = pick("HTTP parser", args.http, HTTP_PARSERS)
+
+    # settings for the app travel through the environment, so every worker process sees them
+    os.environ["CHINITSU_DRAIN_TIMEOUT"] = str(args.drain_timeout)
+    if args.capture:
+        if args.workers > 1:
+            sys.exit("--capture needs --workers 1 (one capture file per process)")
+        os.environ["CHINITSU_CAPTURE"] = args.capture
+    if args.workers > 1:
+        logger.warning("--workers > 1: matchmaking (/match) is disabled, every worker would have its own queue")
+        os.environ["CHINITSU_MATCHMAKING"] = "0"
+
+    # the game modules log through the "uvicorn" logger, which uvicorn's --log-level leaves at INFO
+    log_config = copy.deepcopy(uvicorn.config.LOGGING_CONFIG)
+    log_config["loggers"]["uvicorn"]["level"] = args.log_level.upper()
+
+    logger.info(f"loop={loop} http={http} ws={args.ws} workers={args.workers}")
+    uvicorn.run("server:app", app_dir=SERVER_DIR, host=args.host, port=args.port, workers=args.workers,
+                loop=loop, http=http, ws=args.ws, log_level=args.log_level, log_config=log_config)
+
 
 if __name__ == "__main__":
-    
-    from server import app
-    uvicorn.run(app, host="127.0.0.1", port=8000, log_config=logging_config)
\ No newline at end of file
+    main()
@@ -0,0 +1,162 @@
+# pylint: disable=missing-function-docstring, missing-module-docstring, missing-class-docstring, line-too-long
+import asyncio, json, time
+import pytest
+import fuzz
+from heartbeat import Heartbeat
+from matchmaking import MatchQueue
+from metrics import Histogram
+import replay, server
+from capture import TrafficRecorder, load_capture
+from server import GameManager
+
+
+@pytest.mark.parametrize("allow_agari", [False, True])
+def test_fuzz_fixed_seeds(allow_agari):
+    for case_seed in range(1000):
+        steps, err = fuzz.generate_case(case_seed, 200, allow_agari)
+        assert err is None, f"case {case_seed} failed with {fuzz.signature(err)} after {len(steps)} steps"
+
+
+def test_histogram():
+    hist = Histogram([1, 2, 5])
+    for value in (0.5, 1, 1.5, 4, 10):
+        hist.observe(value)
+    snap = hist.snapshot()
+    assert snap["count"] == 5 and snap["max"] == 10 and snap["sum"] == 17
+    assert snap["buckets"] == {"1": 2, "2": 1, "5": 1, "+inf": 1}
+    assert hist.quantile(0.5) == 2
+    assert Histogram().snapshot()["count"] == 0
+
+
+def test_match_queue():
+    async def run():
+        gm = GameManager()
+        mq = MatchQueue(gm, claim_timeout=0.01)
+        a = mq.enqueue("a", rating=1500)
+        far = mq.enqueue("far", rating=2500)  # other rating band
+        with pytest.raises(ValueError):
+            mq.enqueue("a")
+        with pytest.raises(KeyError):
+            mq.enqueue("x", rule_set="nope")
+        assert mq.num_waiting == 2 and not a.future.done()
+
+        b = mq.enqueue("b", rating=1450)
+        room_name = a.future.result()
+        assert b.future.result() == room_name and not far.future.done()
+        assert gm.get_game(room_name) is not None
+        assert gm.is_reserved_for_others(room_name, "x") and not gm.is_reserved_for_others(room_name, "b")
+        assert mq.stats()["wait_time"]["default"]["count"] == 2
+
+        mq.cancel("far")
+        assert far.future.cancelled() and mq.num_waiting == 0 and not mq.shards
+        await asyncio.sleep(0.05)
+        assert gm.get_game(room_name) is None  # nobody claimed the room
+    asyncio.run(run())
+
+
+def test_reservation_survives_host_leaving():
+    from fastapi.testclient import TestClient  # pylint: disable=import-outside-toplevel
+    from starlette.websockets import WebSocketDisconnect  # pylint: disable=import-outside-toplevel
+    gm = server.gm
+    rules = {"initial_point": 24000}
+    with TestClient(server.app) as client:
+        gm.reserve("match-test", ("a", "b"), rules)
+        gm.init_game("match-test", rules)
+        with client.websocket_connect("/ws/match-test/a") as ws:
+            ws.receive_json()
+        assert gm.get_game("match-test") is None and "match-test" in gm.reservations  # host left before b arrived
+
+        with pytest.raises(WebSocketDisconnect) as rejected:
+            with client.websocket_connect("/ws/match-test/eve") as ws:
+                ws.receive_json()
+        assert rejected.value.reason == "room_reserved"
+
+        with client.websocket_connect("/ws/match-test/b") as b, client.websocket_connect("/ws/match-test/a") as a:
+            b.receive_json()
+            assert gm.get_game("match-test").rules["initial_point"] == 24000
+            assert gm.reservations["match-test"].claimed
+            a.receive_json()
+        assert "match-test" not in gm.reservations and gm.get_game("match-test") is None
+
+
+class FakeWebSocket:
+    def __init__(self, fail=False) -> None:
+        self.sent = []
+        self.fail = fail
+
+    async def send_json(self, data):
+        if self.fail:
+            raise RuntimeError("closed")
+        self.sent.append(data)
+
+
+def test_heartbeat_tick():
+    async def run():
+        dead = []
+
+        async def on_dead(websocket, room_name, player_id):
+            dead.append(player_id)
+
+        hb = Heartbeat(on_dead, interval=3600, timeout=5)
+        alive, silent, broken = FakeWebSocket(), FakeWebSocket(), FakeWebSocket(fail=True)
+        hb.register(alive, "room", "alive")
+        hb.register(silent, "room", "silent")
+        hb.register(broken, "room", "broken")
+        hb.peers[silent].last_seen = time.monotonic() - 10
+
+        await hb.tick()
+        assert sorted(dead) == ["broken", "silent"] and list(hb.peers) == [alive]
+        ping = alive.sent[0]
+        assert ping["heartbeat"] == "ping" and ping["broadcast"] is False
+
+        await hb.tick()
+        assert len(alive.sent) == 1  # no second ping while the first is unanswered
+        hb.pong(alive, {"heartbeat": "pong", "seq": ping["seq"]})
+        assert hb.stats()["rooms"]["room"]["alive"]["rtt"]["count"] == 1
+        hb.unregister(alive)
+        hb._task.cancel()  # pylint: disable=protected-access
+    asyncio.run(run())
+
+
+def test_capture_replay_round_trip(tmp_path):
+    import websockets  # pylint: disable=import-outside-toplevel
+    path = str(tmp_path / "capture.jsonl")
+
+    async def record():
+        server.gm.recorder = server.manager.recorder = TrafficRecorder(path)
+        srv, task, url = await replay.spawn_server([])
+        a = await websockets.connect(f"{url}/ws/r/a")
+        b = await websockets.connect(f"{url}/ws/r/b")
+        readers = [asyncio.ensure_future(_drain(ws)) for ws in (a, b)]
+        moves = [(a, "start_new", "")] + [(ws, action, "0") for _ in range(6) for ws in (a, b) for action in ("draw", "discard", "skip_ron")]
+        for ws, action, card_idx in moves:
+            await ws.send(json.dumps({"action": action, "card_idx": card_idx}))
+            await asyncio.sleep(0.01)
+        await a.close()  # one player leaves first, the other sees "a left the room r"
+        await asyncio.sleep(0.05)
+        await b.close()
+        await asyncio.gather(*readers)
+        srv.should_exit = True
+        await task
+        server.gm.recorder = server.manager.recorder = None
+
+    async def play_back():
+        events = load_capture(path)
+        srv, task, url = await replay.spawn_server(events)
+        divergences = await replay.Replayer(events, url, float("inf"), timeout=1.0).run()
+        srv.should_exit = True
+        await task
+        return events, divergences
+
+    asyncio.run(record())
+    events, divergences = asyncio.run(play_back())
+    assert sum(e["event"] == "close" for e in events) == 2
+    assert divergences == []
+
+
+async def _drain(websocket):
+    try:
+        async for _ in websocket:
+            pass
+    except Exception:  # pylint: disable=broad-except
+        pass